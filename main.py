@@ -1,11 +1,20 @@
 import os
 import json
+import fcntl
+import tempfile
+import math
+import codecs
+import difflib
+import unicodedata
 import requests
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import pytz
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from flask import Flask, request
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # ============================================
 # CONFIGURAÇÕES
@@ -17,6 +26,33 @@ ALERTAR_FALHA = os.environ.get('ALERTAR_FALHA', 'false').lower() == 'true'
 PORT = int(os.environ.get('PORT', 10000))
 SITE_URL = "https://ccm.artesp.sp.gov.br/metroferroviario/status-linhas/"
 TIMEOUT = 30
+STATUS_STREAMING = os.environ.get('STATUS_STREAMING', 'true').lower() == 'true'
+STATUS_CHUNK_BYTES = 8192
+STATUS_MAX_BYTES = int(os.environ.get('STATUS_MAX_BYTES', 2_000_000))
+CONTEXTO_STATUS = 800  # caracteres após o nome da linha onde o status é procurado
+PRAZO_COMANDO = float(os.environ.get('PRAZO_COMANDO', 20))  # segundos por comando
+PRAZO_ALERTA = float(os.environ.get('PRAZO_ALERTA', 60))  # segundos para o alerta diário
+PRAZO_MINIMO_ENVIO = 3  # tempo mínimo para entregar a resposta (mesmo parcial)
+HEDGE_ATRASO_PADRAO = 2.0  # atraso do hedge enquanto não há amostras de latência
+HEDGE_MAXIMO_EM_VOO = 4  # segundas tentativas simultâneas; acima disso não há hedge
+HISTORICO_ARQUIVO = os.environ.get('HISTORICO_ARQUIVO', 'historico_linhas.log')
+HISTORICO_INTERVALO_MAXIMO = 3600  # lacunas maiores entre observações não contam para o uptime
+HISTORICO_AMOSTRAGEM = int(os.environ.get('HISTORICO_AMOSTRAGEM', 600))  # segundos entre amostras do agendador
+AGENDADOR_ATIVO = os.environ.get('AGENDADOR_ATIVO', 'false').lower() == 'true'
+HORARIOS_ALERTA = [h.strip() for h in os.environ.get('HORARIOS_ALERTA', '07:00,17:00').split(',') if h.strip()]
+ANTECEDENCIA_AQUECIMENTO = int(os.environ.get('ANTECEDENCIA_AQUECIMENTO', 90))  # segundos antes do alerta
+AGENDADOR_DIR = os.environ.get('AGENDADOR_DIR', tempfile.gettempdir())
+FERIADOS_EXTRAS = [d.strip() for d in os.environ.get('FERIADOS_EXTRAS', '').split(',') if d.strip()]
+LINHAS_ALERTA = ["2", "4", "15"]
+SERVIDOR_URL = os.environ.get('SERVIDOR_URL', '').rstrip('/')  # usado pela reserva no GitHub Actions
+RESERVA_JANELA = 3600  # a reserva cobre um alerta até 1h depois do horário (atrasos do cron)
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', 120))  # segundos de cache no Telegram
+INLINE_IDADE_MAXIMA = 300  # snapshot de status mais velho que isso é atualizado em segundo plano
+INLINE_ESPERA_FALHA = 30  # segundos sem consultar a ARTESP pelo modo inline após uma falha
+MODO_EXECUCAO = os.environ.get('MODO_EXECUCAO', 'webhook').lower()
+POLLING_TIMEOUT = int(os.environ.get('POLLING_TIMEOUT', 30))
+POLLING_LOTE_MAXIMO = int(os.environ.get('POLLING_LOTE_MAXIMO', 100))
+POLLING_WORKERS = int(os.environ.get('POLLING_WORKERS', 8))
 
 # ============================================
 # TODAS AS LINHAS DISPONÍVEIS
@@ -151,8 +187,164 @@ LINHAS_POR_REGIAO = {
     }
 }
 
+# ============================================
+# COORDENADAS DAS ESTAÇÕES (CLIMA POR ESTAÇÃO)
+# ============================================
+ESTACOES = {
+    "Tucuruvi": {"lat": -23.4803, "lon": -46.6036, "linhas": ["1"]},
+    "Santana": {"lat": -23.5025, "lon": -46.6250, "linhas": ["1"]},
+    "Sé": {"lat": -23.5503, "lon": -46.6339, "linhas": ["1", "3"]},
+    "Jabaquara": {"lat": -23.6460, "lon": -46.6412, "linhas": ["1"]},
+    "Vila Prudente": {"lat": -23.5822, "lon": -46.5817, "linhas": ["2", "15"]},
+    "Paraíso": {"lat": -23.5755, "lon": -46.6406, "linhas": ["1", "2"]},
+    "Consolação": {"lat": -23.5577, "lon": -46.6602, "linhas": ["2"]},
+    "Clínicas": {"lat": -23.5540, "lon": -46.6705, "linhas": ["2"]},
+    "Alto de Pinheiros": {"lat": -23.5465, "lon": -46.6910, "linhas": ["2"]},
+    "Corinthians-Itaquera": {"lat": -23.5424, "lon": -46.4714, "linhas": ["3", "11"]},
+    "Tatuapé": {"lat": -23.5403, "lon": -46.5765, "linhas": ["3", "11", "12"]},
+    "Barra Funda": {"lat": -23.5256, "lon": -46.6673, "linhas": ["3", "7", "8"]},
+    "Luz": {"lat": -23.5363, "lon": -46.6333, "linhas": ["1", "4", "7", "11"]},
+    "República": {"lat": -23.5440, "lon": -46.6424, "linhas": ["3", "4"]},
+    "Paulista": {"lat": -23.5550, "lon": -46.6625, "linhas": ["4"]},
+    "Trianon-Masp": {"lat": -23.5614, "lon": -46.6559, "linhas": ["2"]},
+    "Faria Lima": {"lat": -23.5671, "lon": -46.6931, "linhas": ["4"]},
+    "Morumbi": {"lat": -23.5870, "lon": -46.7240, "linhas": ["4"]},
+    "Capão Redondo": {"lat": -23.6601, "lon": -46.7679, "linhas": ["5"]},
+    "Santo Amaro": {"lat": -23.6547, "lon": -46.7094, "linhas": ["5", "9"]},
+    "Chácara Klabin": {"lat": -23.5926, "lon": -46.6295, "linhas": ["2", "5"]},
+    "Pirituba": {"lat": -23.4893, "lon": -46.7266, "linhas": ["7"]},
+    "Franco da Rocha": {"lat": -23.3268, "lon": -46.7290, "linhas": ["7"]},
+    "Jundiaí": {"lat": -23.1895, "lon": -46.8847, "linhas": ["7"]},
+    "Júlio Prestes": {"lat": -23.5346, "lon": -46.6405, "linhas": ["8"]},
+    "Osasco": {"lat": -23.5277, "lon": -46.7752, "linhas": ["8", "9"]},
+    "Barueri": {"lat": -23.5109, "lon": -46.8769, "linhas": ["8"]},
+    "Itapevi": {"lat": -23.5494, "lon": -46.9339, "linhas": ["8"]},
+    "Pinheiros": {"lat": -23.5672, "lon": -46.7019, "linhas": ["4", "9"]},
+    "Granja Viana": {"lat": -23.5937, "lon": -46.8322, "linhas": ["9"]},
+    "Brás": {"lat": -23.5453, "lon": -46.6158, "linhas": ["3", "10", "11", "12"]},
+    "São Caetano": {"lat": -23.6188, "lon": -46.5597, "linhas": ["10"]},
+    "Santo André": {"lat": -23.6573, "lon": -46.5287, "linhas": ["10"]},
+    "Mauá": {"lat": -23.6679, "lon": -46.4614, "linhas": ["10"]},
+    "Rio Grande da Serra": {"lat": -23.7440, "lon": -46.3978, "linhas": ["10"]},
+    "Itaquera": {"lat": -23.5408, "lon": -46.4716, "linhas": ["3", "11"]},
+    "Mogi das Cruzes": {"lat": -23.5230, "lon": -46.1858, "linhas": ["11"]},
+    "Itaim Paulista": {"lat": -23.4985, "lon": -46.3992, "linhas": ["12"]},
+    "Engenheiro Goulart": {"lat": -23.4884, "lon": -46.5240, "linhas": ["12", "13"]},
+    "Aeroporto Guarulhos": {"lat": -23.4356, "lon": -46.4731, "linhas": ["13"]},
+    "São Mateus": {"lat": -23.6113, "lon": -46.4781, "linhas": ["15"]},
+    "Cidade Tiradentes": {"lat": -23.5946, "lon": -46.4005, "linhas": ["15"]}
+}
+
+# Tamanho da célula da grade de previsão (~5,5 km). Estações na mesma célula
+# compartilham uma única consulta ao Open-Meteo.
+CELULA_PREVISAO_GRAUS = 0.05
+
 app = Flask(__name__)
 
+# ============================================
+# PRAZOS E REQUISIÇÕES COM HEDGE
+# ============================================
+class PrazoEsgotado(Exception):
+    """O orçamento de tempo acabou antes da resposta do serviço externo"""
+
+class Prazo:
+    """Orçamento de tempo de um comando, repassado a cada chamada externa"""
+
+    def __init__(self, segundos: float):
+        self.limite = time.time() + segundos
+
+    def restante(self) -> float:
+        return max(0.0, self.limite - time.time())
+
+    def esgotado(self) -> bool:
+        return self.restante() <= 0
+
+    def timeout(self, maximo: float, minimo: float = 0.1) -> float:
+        """Timeout de uma chamada: o menor entre o máximo e o que resta do prazo"""
+        return max(minimo, min(maximo, self.restante()))
+
+class LatenciaUpstream:
+    """Janela das últimas latências de um serviço externo, para estimar o p95"""
+
+    def __init__(self, tamanho: int = 50, minimo_amostras: int = 5):
+        self.amostras = deque(maxlen=tamanho)
+        self.minimo_amostras = minimo_amostras
+
+    def registrar(self, segundos: float):
+        self.amostras.append(segundos)
+
+    def p95(self) -> float:
+        amostras = sorted(self.amostras)
+        if len(amostras) < self.minimo_amostras:
+            return HEDGE_ATRASO_PADRAO
+        return amostras[int(0.95 * (len(amostras) - 1))]
+
+LATENCIAS: Dict[str, LatenciaUpstream] = {}
+_EXECUTOR_HEDGE = ThreadPoolExecutor(max_workers=16)
+_LOCK_LATENCIAS = threading.Lock()
+_HEDGES_EM_VOO = threading.BoundedSemaphore(HEDGE_MAXIMO_EM_VOO)
+
+def executar_com_hedge(nome: str, funcao, prazo: Optional[Prazo] = None, timeout_maximo: float = TIMEOUT):
+    """Executa uma chamada idempotente; se passar do p95, dispara uma segunda e usa a primeira resposta
+
+    funcao(timeout, cancelado) recebe um threading.Event que é ligado quando a
+    resposta já veio de outra tentativa ou o prazo acabou; quem lê em blocos
+    deve verificá-lo e largar a conexão para liberar a thread do pool.
+    """
+    prazo = prazo or Prazo(timeout_maximo)
+    if prazo.esgotado():
+        raise PrazoEsgotado(f"prazo esgotado aguardando {nome}")
+
+    with _LOCK_LATENCIAS:
+        latencia = LATENCIAS.setdefault(nome, LatenciaUpstream())
+
+    cancelado = threading.Event()
+
+    def tentativa(hedge=False):
+        try:
+            # Ainda na fila do pool quando a resposta já chegou: nem começa
+            if cancelado.is_set():
+                return None
+            inicio = time.time()
+            try:
+                return funcao(prazo.timeout(timeout_maximo), cancelado)
+            finally:
+                # Falhas e timeouts também entram, senão o p95 só vê as respostas rápidas
+                latencia.registrar(time.time() - inicio)
+        finally:
+            if hedge:
+                _HEDGES_EM_VOO.release()
+
+    futuros = [_EXECUTOR_HEDGE.submit(tentativa)]
+    try:
+        atraso = latencia.p95()
+        feitos, _ = wait(futuros, timeout=min(atraso, prazo.restante()))
+
+        if not feitos and not prazo.esgotado():
+            if _HEDGES_EM_VOO.acquire(blocking=False):
+                print(f"🐢 {nome}: passou do p95 ({atraso:.2f}s) - disparando segunda tentativa")
+                futuros.append(_EXECUTOR_HEDGE.submit(tentativa, True))
+            else:
+                print(f"🐢 {nome}: passou do p95 ({atraso:.2f}s) - limite de {HEDGE_MAXIMO_EM_VOO} hedges atingido, aguardando")
+
+        erro = None
+        pendentes = set(futuros)
+        while pendentes:
+            feitos, pendentes = wait(pendentes, timeout=prazo.restante(), return_when=FIRST_COMPLETED)
+            if not feitos:
+                break
+            for futuro in feitos:
+                if futuro.exception() is None:
+                    return futuro.result()
+                erro = futuro.exception()
+
+        if erro is not None and not pendentes:
+            raise erro
+        raise PrazoEsgotado(f"prazo esgotado aguardando {nome}")
+    finally:
+        # Libera as tentativas que perderam a corrida (ou ficaram sem prazo)
+        cancelado.set()
+
 # ============================================
 # FUNÇÕES AUXILIARES
 # ============================================
@@ -163,7 +355,7 @@ def get_sp_time() -> str:
     agora_sp = agora_utc.astimezone(fuso_sp)
     return agora_sp.strftime("%d/%m/%Y %H:%M:%S")
 
-def send_telegram_message(chat_id: str, message: str) -> bool:
+def send_telegram_message(chat_id: str, message: str, prazo: Optional[Prazo] = None) -> bool:
     """Envia mensagem para o Telegram"""
     if not TELEGRAM_TOKEN:
         print("❌ Erro: TELEGRAM_TOKEN não configurado")
@@ -179,7 +371,8 @@ def send_telegram_message(chat_id: str, message: str) -> bool:
     }
     
     try:
-        response = requests.post(url, data=data, timeout=15)
+        timeout = prazo.timeout(15, minimo=PRAZO_MINIMO_ENVIO) if prazo else 15
+        response = requests.post(url, data=data, timeout=timeout)
         return response.status_code == 200
     except Exception as e:
         print(f"❌ Erro ao enviar mensagem: {str(e)}")
@@ -188,6 +381,49 @@ def send_telegram_message(chat_id: str, message: str) -> bool:
 # ============================================
 # FUNÇÕES DO METRÔ
 # ============================================
+def _variacoes_nome(nome_linha: str) -> List[str]:
+    """Lista de possíveis variações do nome da linha no HTML"""
+    variacoes_nome = [
+        nome_linha,
+        nome_linha.replace("-", " "),
+        nome_linha.replace("-", " - "),
+        nome_linha.split("-")[0].strip(),
+    ]
+    
+    # Para linha 4, adiciona variações específicas
+    if "4" in nome_linha:
+        variacoes_nome.extend([
+            "ViaQuatro",
+            "Linha 4",
+            "Amarela"
+        ])
+    
+    return variacoes_nome
+
+def _status_do_contexto(contexto: str) -> Dict[str, Any]:
+    """Identifica o status no trecho do HTML logo após o nome da linha"""
+    resultado = {
+        'status': '⚠️ Status desconhecido',
+        'detalhes': 'Linha encontrada mas status não identificado',
+        'success': False
+    }
+    
+    if "Operação Normal" in contexto:
+        resultado['status'] = "✅ Operação Normal"
+        resultado['detalhes'] = ''
+        resultado['success'] = True
+    elif "Operação Encerrada" in contexto:
+        resultado['status'] = "🟡 Operação Encerrada"
+        resultado['detalhes'] = "Linha fora de operação"
+    elif "Velocidade Reduzida" in contexto:
+        resultado['status'] = "🟠 Velocidade Reduzida"
+        resultado['detalhes'] = "Operação com lentidão"
+    elif "Paralisada" in contexto:
+        resultado['status'] = "🔴 Paralisada"
+        resultado['detalhes'] = "Linha paralisada"
+    
+    return resultado
+
 def extrair_status_linha(html_content: str, nome_linha: str) -> Dict[str, Any]:
     """Extrai o status de uma linha específica do HTML"""
     resultado = {
@@ -197,52 +433,15 @@ def extrair_status_linha(html_content: str, nome_linha: str) -> Dict[str, Any]:
     }
     
     try:
-        # Lista de possíveis variações do nome da linha
-        variacoes_nome = [
-            nome_linha,
-            nome_linha.replace("-", " "),
-            nome_linha.replace("-", " - "),
-            nome_linha.split("-")[0].strip(),
-        ]
-        
-        # Para linha 4, adiciona variações específicas
-        if "4" in nome_linha:
-            variacoes_nome.extend([
-                "ViaQuatro",
-                "Linha 4",
-                "Amarela"
-            ])
-        
         # Procura por qualquer variação
-        encontrado = False
-        contexto = ""
-        
-        for variacao in variacoes_nome:
+        for variacao in _variacoes_nome(nome_linha):
             if variacao in html_content:
                 index = html_content.find(variacao)
-                contexto = html_content[index:index + 800]
-                encontrado = True
+                contexto = html_content[index:index + CONTEXTO_STATUS]
                 print(f"✅ Encontrou variação: '{variacao}'")
-                break
+                return _status_do_contexto(contexto)
         
-        if encontrado:
-            if "Operação Normal" in contexto:
-                resultado['status'] = "✅ Operação Normal"
-                resultado['success'] = True
-            elif "Operação Encerrada" in contexto:
-                resultado['status'] = "🟡 Operação Encerrada"
-                resultado['detalhes'] = "Linha fora de operação"
-            elif "Velocidade Reduzida" in contexto:
-                resultado['status'] = "🟠 Velocidade Reduzida"
-                resultado['detalhes'] = "Operação com lentidão"
-            elif "Paralisada" in contexto:
-                resultado['status'] = "🔴 Paralisada"
-                resultado['detalhes'] = "Linha paralisada"
-            else:
-                resultado['status'] = "⚠️ Status desconhecido"
-                resultado['detalhes'] = "Linha encontrada mas status não identificado"
-        else:
-            print(f"❌ Linha '{nome_linha}' não encontrada no HTML")
+        print(f"❌ Linha '{nome_linha}' não encontrada no HTML")
             
     except Exception as e:
         resultado['detalhes'] = str(e)[:50]
@@ -250,19 +449,103 @@ def extrair_status_linha(html_content: str, nome_linha: str) -> Dict[str, Any]:
     
     return resultado
 
-def verificar_linha_especifica(linha_id: str) -> Optional[Dict[str, Any]]:
+def _baixar_status_streaming(linha_ids: List[str], headers: Dict[str, str], timeout: float,
+                             cancelado: Optional[threading.Event] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Lê a página em blocos e encerra a conexão assim que todas as linhas têm status"""
+    inicio = time.time()
+    
+    # Só a variação principal (o nome exato) resolve cedo, como em
+    # extrair_status_linha, que a prefere onde quer que apareça. As demais só
+    # valem se ela não existir na página, o que exige ler a página inteira.
+    pendentes = {lid: TODAS_LINHAS[lid]['nome'] for lid in linha_ids}
+    procurado_ate = {lid: 0 for lid in linha_ids}
+    posicoes: Dict[str, int] = {}
+    resolvidos: Dict[str, Dict[str, Any]] = {}
+    html = ""
+    bytes_lidos = 0
+    completo = False
+    
+    with requests.get(SITE_URL, timeout=timeout, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            return None
+        
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        
+        for chunk in response.iter_content(chunk_size=STATUS_CHUNK_BYTES):
+            if cancelado is not None and cancelado.is_set():
+                print(f"✂️ Leitura cancelada após {bytes_lidos} bytes - outra tentativa já respondeu")
+                return None
+            bytes_lidos += len(chunk)
+            html += decoder.decode(chunk)
+            
+            for lid in list(pendentes):
+                if lid not in posicoes:
+                    variacao = pendentes[lid]
+                    index = html.find(variacao, max(0, procurado_ate[lid] - len(variacao)))
+                    procurado_ate[lid] = len(html)
+                    if index >= 0:
+                        posicoes[lid] = index
+                
+                if lid in posicoes and len(html) >= posicoes[lid] + CONTEXTO_STATUS:
+                    index = posicoes[lid]
+                    resolvidos[lid] = _status_do_contexto(html[index:index + CONTEXTO_STATUS])
+                    del pendentes[lid]
+            
+            if not pendentes:
+                break
+            if bytes_lidos >= STATUS_MAX_BYTES:
+                print(f"⚠️ Página passou de {STATUS_MAX_BYTES} bytes - leitura interrompida")
+                break
+        else:
+            html += decoder.decode(b'', final=True)
+            completo = True
+    
+    # Linhas que não resolveram cedo usam a mesma busca do download completo
+    for lid in pendentes:
+        resolvidos[lid] = extrair_status_linha(html, TODAS_LINHAS[lid]['nome'])
+    
+    print(f"📉 Status via streaming: {bytes_lidos} bytes em {time.time() - inicio:.2f}s "
+          f"({'página completa' if completo else 'conexão encerrada antes do fim'})")
+    
+    return resolvidos
+
+def _baixar_status_completo(linha_ids: List[str], headers: Dict[str, str], timeout: float,
+                            cancelado: Optional[threading.Event] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Baixa a página inteira antes de procurar as linhas"""
+    inicio = time.time()
+    response = requests.get(SITE_URL, timeout=timeout, headers=headers)
+    
+    if response.status_code != 200:
+        return None
+    
+    html = response.text
+    print(f"📄 Status completo: {len(response.content)} bytes em {time.time() - inicio:.2f}s")
+    
+    return {lid: extrair_status_linha(html, TODAS_LINHAS[lid]['nome']) for lid in linha_ids}
+
+def obter_status_linhas(linha_ids: List[str], prazo: Optional[Prazo] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Baixa a página da ARTESP e extrai o status das linhas pedidas"""
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    baixar = _baixar_status_streaming if STATUS_STREAMING else _baixar_status_completo
+    
+    status_linhas = executar_com_hedge('artesp', lambda timeout, cancelado: baixar(linha_ids, headers, timeout, cancelado), prazo, TIMEOUT)
+    
+    if status_linhas:
+        HISTORICO.registrar(status_linhas)
+    
+    return status_linhas
+
+def verificar_linha_especifica(linha_id: str, prazo: Optional[Prazo] = None) -> Optional[Dict[str, Any]]:
     """Verifica uma linha específica"""
     if linha_id not in TODAS_LINHAS:
         return None
     
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(SITE_URL, timeout=TIMEOUT, headers=headers)
+        status_linhas = obter_status_linhas([linha_id], prazo)
         
-        if response.status_code == 200:
-            html = response.text
+        if status_linhas is not None:
             linha_info = TODAS_LINHAS[linha_id]
-            status_info = extrair_status_linha(html, linha_info['nome'])
+            status_info = status_linhas[linha_id]
             
             return {
                 'id': linha_id,
@@ -277,19 +560,16 @@ def verificar_linha_especifica(linha_id: str) -> Optional[Dict[str, Any]]:
     
     return None
 
-def verificar_todas_linhas() -> List[Dict[str, Any]]:
+def verificar_todas_linhas(prazo: Optional[Prazo] = None) -> List[Dict[str, Any]]:
     """Verifica todas as linhas"""
     resultados = []
     
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(SITE_URL, timeout=TIMEOUT, headers=headers)
+        status_linhas = obter_status_linhas(list(TODAS_LINHAS), prazo)
         
-        if response.status_code == 200:
-            html = response.text
-            
+        if status_linhas is not None:
             for linha_id, linha_info in TODAS_LINHAS.items():
-                status_info = extrair_status_linha(html, linha_info['nome'])
+                status_info = status_linhas[linha_id]
                 resultados.append({
                     'id': linha_id,
                     'nome': linha_info['nome'],
@@ -298,21 +578,368 @@ def verificar_todas_linhas() -> List[Dict[str, Any]]:
                     'success': status_info['success'],
                     'detalhes': status_info['detalhes']
                 })
+            
+            _SNAPSHOT_STATUS.update(ts=time.time(), resultados=resultados)
     except Exception as e:
         print(f"❌ Erro: {str(e)}")
     
     return resultados
 
+# Última consulta completa de status (usada para aquecer o alerta agendado)
+_SNAPSHOT_STATUS: Dict[str, Any] = {'ts': 0.0, 'resultados': []}
+
+def snapshot_status(max_idade: float) -> List[Dict[str, Any]]:
+    """Retorna a última consulta de todas as linhas, se tiver no máximo `max_idade` segundos"""
+    if time.time() - _SNAPSHOT_STATUS['ts'] <= max_idade:
+        return _SNAPSHOT_STATUS['resultados']
+    return []
+
+# ============================================
+# HISTÓRICO DE DISPONIBILIDADE DAS LINHAS
+# ============================================
+# Códigos gravados no histórico: N=normal, E=encerrada, R=velocidade reduzida,
+# P=paralisada, D=desconhecido
+CODIGOS_STATUS = {
+    "✅ Operação Normal": "N",
+    "🟡 Operação Encerrada": "E",
+    "🟠 Velocidade Reduzida": "R",
+    "🔴 Paralisada": "P"
+}
+CODIGOS_FALHA = ("R", "P")
+
+class HistoricoLinhas:
+    """Histórico de status em arquivo (só acrescenta) com agregados mantidos a cada gravação.
+
+    Vários workers podem gravar no mesmo arquivo: antes de cada leitura ou
+    gravação, o worker aplica (sob flock) as linhas que os outros acrescentaram
+    desde a última posição lida, e assim todos enxergam os mesmos agregados.
+    A compactação troca o arquivo (novo inode); quem percebe a troca recarrega.
+    """
+
+    def __init__(self, arquivo: str):
+        self.arquivo = arquivo
+        self.lock = threading.Lock()
+        self.inode: Optional[int] = None
+        self.posicao = 0  # bytes do arquivo já aplicados aos agregados
+        # linha -> estado da última observação
+        self.estado: Dict[str, Dict[str, Any]] = {}
+        # linha -> período ("dia:2026-10-19", "semana:2026-W43", "mes:2026-10") -> agregados
+        self.agregados: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    def _periodos(self, ts: float) -> List[str]:
+        """Chaves de dia, semana e mês (fuso de SP) de um instante"""
+        data = datetime.fromtimestamp(ts, pytz.timezone('America/Sao_Paulo'))
+        ano, semana, _ = data.isocalendar()
+        return [f"dia:{data:%Y-%m-%d}", f"semana:{ano}-W{semana:02d}", f"mes:{data:%Y-%m}"]
+
+    def _somar(self, linha_id: str, ts: float, campo: str, valor: float):
+        por_periodo = self.agregados.setdefault(linha_id, {})
+        for periodo in self._periodos(ts):
+            agregado = por_periodo.setdefault(periodo, {
+                'no_ar': 0.0, 'fora': 0.0, 'incidentes': 0, 'recuperacao_total': 0.0, 'recuperacoes': 0
+            })
+            agregado[campo] += valor
+
+    def _aplicar(self, linha_id: str, ts: float, codigo: str):
+        """Atualiza os agregados com uma observação nova"""
+        anterior = self.estado.get(linha_id)
+        inicio_incidente = anterior['inicio_incidente'] if anterior else None
+
+        # O intervalo desde a observação anterior conta para o status anterior;
+        # lacunas longas (sem consultas) ficam de fora por completo
+        if anterior:
+            intervalo = ts - anterior['ts']
+            if intervalo > HISTORICO_INTERVALO_MAXIMO:
+                # Não dá para saber quando um incidente aberto terminou
+                inicio_incidente = None
+            elif intervalo > 0:
+                if anterior['codigo'] == "N":
+                    self._somar(linha_id, anterior['ts'], 'no_ar', intervalo)
+                elif anterior['codigo'] in CODIGOS_FALHA:
+                    self._somar(linha_id, anterior['ts'], 'fora', intervalo)
+
+        if codigo in CODIGOS_FALHA and inicio_incidente is None:
+            inicio_incidente = ts
+            self._somar(linha_id, ts, 'incidentes', 1)
+        elif codigo == "N" and inicio_incidente is not None:
+            self._somar(linha_id, ts, 'recuperacao_total', ts - inicio_incidente)
+            self._somar(linha_id, ts, 'recuperacoes', 1)
+            inicio_incidente = None
+        elif codigo == "E":
+            # Encerramento noturno não conta como recuperação
+            inicio_incidente = None
+
+        self.estado[linha_id] = {'ts': ts, 'codigo': codigo, 'inicio_incidente': inicio_incidente}
+
+    def _abrir_travado(self, modo: str, tipo_lock: int):
+        """Abre o arquivo com flock, garantindo que ele não foi trocado pela compactação enquanto esperava"""
+        while True:
+            f = open(self.arquivo, modo)
+            fcntl.flock(f, tipo_lock)
+            try:
+                if os.stat(self.arquivo).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _reiniciar(self):
+        self.inode = None
+        self.posicao = 0
+        self.estado = {}
+        self.agregados = {}
+
+    def _sincronizar(self, f):
+        """Aplica as linhas acrescentadas ao arquivo desde a última leitura (com o flock já obtido)"""
+        info = os.fstat(f.fileno())
+        if info.st_ino != self.inode or info.st_size < self.posicao:
+            if self.inode is not None:
+                print("🔄 Histórico compactado por outro worker - recarregando")
+            self._reiniciar()
+            self.inode = info.st_ino
+        f.seek(self.posicao)
+        novos = f.read()
+        # Só linhas completas; um final sem quebra fica para a próxima leitura
+        completos = novos[:novos.rfind(b"\n") + 1]
+        for linha in completos.decode('utf-8').splitlines():
+            partes = linha.split()
+            if len(partes) == 3:
+                self._aplicar(partes[1], int(partes[0]), partes[2])
+        self.posicao += len(completos)
+
+    def registrar(self, status_linhas: Dict[str, Dict[str, Any]], ts: Optional[float] = None):
+        """Grava uma observação de status por linha e atualiza os agregados"""
+        with self.lock:
+            try:
+                with self._abrir_travado('a+b', fcntl.LOCK_EX) as f:
+                    self._sincronizar(f)
+
+                    # Horário tirado sob o lock: as linhas do arquivo ficam em ordem
+                    agora = int(ts if ts is not None else time.time())
+                    registros = []
+                    for linha_id, status_info in status_linhas.items():
+                        codigo = CODIGOS_STATUS.get(status_info['status'], "D")
+                        if codigo == "D":
+                            continue
+                        self._aplicar(linha_id, agora, codigo)
+                        registros.append(f"{agora} {linha_id} {codigo}\n")
+
+                    dados = "".join(registros).encode('utf-8')
+                    f.write(dados)
+                    f.flush()
+                    self.posicao += len(dados)
+            except Exception as e:
+                print(f"❌ Erro ao gravar histórico: {str(e)}")
+
+    def resumo(self, linha_id: str, ts: Optional[float] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Uptime, incidentes e MTTR do dia, semana e mês atuais"""
+        ts = ts if ts is not None else time.time()
+
+        with self.lock:
+            if os.path.exists(self.arquivo):
+                try:
+                    with self._abrir_travado('rb', fcntl.LOCK_SH) as f:
+                        self._sincronizar(f)
+                except Exception as e:
+                    print(f"❌ Erro ao ler histórico: {str(e)}")
+
+            por_periodo = self.agregados.get(linha_id, {})
+            resultado = {}
+            for nome, periodo in zip(["dia", "semana", "mes"], self._periodos(ts)):
+                agregado = por_periodo.get(periodo)
+                if not agregado:
+                    resultado[nome] = None
+                    continue
+                observado = agregado['no_ar'] + agregado['fora']
+                resultado[nome] = {
+                    'uptime': 100 * agregado['no_ar'] / observado if observado else None,
+                    'incidentes': agregado['incidentes'],
+                    'mttr': agregado['recuperacao_total'] / agregado['recuperacoes'] if agregado['recuperacoes'] else None
+                }
+            return resultado
+
+    def _inicio_retencao(self, ts: float) -> int:
+        """Início da semana ou do mês atual (o que vier antes): o mais antigo que o /historico mostra"""
+        fuso_sp = pytz.timezone('America/Sao_Paulo')
+        dia = datetime.fromtimestamp(ts, fuso_sp).date()
+        inicio = min(dia - timedelta(days=dia.weekday()), dia.replace(day=1))
+        return int(fuso_sp.localize(datetime.combine(inicio, datetime.min.time())).timestamp())
+
+    def compactar(self, ts: Optional[float] = None):
+        """Descarta observações de períodos que o /historico não mostra mais"""
+        inicio = self._inicio_retencao(ts if ts is not None else time.time())
+
+        with self.lock:
+            if not os.path.exists(self.arquivo):
+                return
+            try:
+                with self._abrir_travado('a+b', fcntl.LOCK_EX) as f:
+                    f.seek(0)
+                    linhas = f.read().splitlines(keepends=True)
+                    mantidas = [l for l in linhas if l.endswith(b"\n") and int(l.split()[0]) >= inicio]
+                    if len(mantidas) == len(linhas):
+                        return
+
+                    # Grava ao lado e troca de uma vez, ainda segurando o lock do arquivo antigo
+                    temporario = f"{self.arquivo}.tmp"
+                    with open(temporario, 'wb') as novo:
+                        novo.write(b"".join(mantidas))
+                        novo.flush()
+                        os.fsync(novo.fileno())
+                    os.replace(temporario, self.arquivo)
+                    self._reiniciar()
+                    print(f"🗜️ Histórico compactado: {len(linhas)} → {len(mantidas)} registros")
+            except Exception as e:
+                print(f"❌ Erro ao compactar histórico: {str(e)}")
+
+HISTORICO = HistoricoLinhas(HISTORICO_ARQUIVO)
+
+def gerar_mensagem_historico(linha_id: str) -> str:
+    """Monta a mensagem do comando /historico"""
+    resumo = HISTORICO.resumo(linha_id)
+    msg = f"📈 *Histórico - {TODAS_LINHAS[linha_id]['nome']}*\n\n"
+
+    for nome, titulo in [("dia", "Hoje"), ("semana", "Semana"), ("mes", "Mês")]:
+        dados = resumo[nome]
+        if not dados:
+            msg += f"*{titulo}:* sem dados\n"
+            continue
+        uptime = f"{dados['uptime']:.1f}% no ar" if dados['uptime'] is not None else "uptime indisponível"
+        msg += f"*{titulo}:* {uptime} | {dados['incidentes']} incidente(s)"
+        if dados['mttr'] is not None:
+            msg += f" | ⏱️ {dados['mttr'] / 60:.0f} min p/ normalizar"
+        msg += "\n"
+
+    msg += f"\n🕐 *Atualizado:* {get_sp_time()}"
+    return msg
+
+# ============================================
+# ÍNDICE ESPACIAL DAS ESTAÇÕES
+# ============================================
+def distancia_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distância em km entre duas coordenadas (fórmula de haversine)"""
+    raio_terra = 6371.0
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + \
+        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * raio_terra * math.asin(math.sqrt(a))
+
+class IndiceEspacial:
+    """Grade regular de coordenadas para buscas por vizinhança"""
+
+    def __init__(self, tamanho_celula: float = CELULA_PREVISAO_GRAUS):
+        self.tamanho_celula = tamanho_celula
+        self.grade: Dict[Tuple[int, int], List[str]] = {}
+        self.coordenadas: Dict[str, Tuple[float, float]] = {}
+
+    def celula(self, lat: float, lon: float) -> Tuple[int, int]:
+        """Retorna a célula da grade que contém a coordenada"""
+        return (math.floor(lat / self.tamanho_celula), math.floor(lon / self.tamanho_celula))
+
+    def centro_celula(self, celula: Tuple[int, int]) -> Tuple[float, float]:
+        """Retorna a coordenada do centro de uma célula"""
+        lat = round((celula[0] + 0.5) * self.tamanho_celula, 4)
+        lon = round((celula[1] + 0.5) * self.tamanho_celula, 4)
+        return lat, lon
+
+    def inserir(self, nome: str, lat: float, lon: float):
+        """Adiciona um ponto ao índice"""
+        self.coordenadas[nome] = (lat, lon)
+        self.grade.setdefault(self.celula(lat, lon), []).append(nome)
+
+    def na_mesma_celula(self, nome: str) -> List[str]:
+        """Pontos que caem na mesma célula (e portanto na mesma previsão)"""
+        if nome not in self.coordenadas:
+            return []
+        lat, lon = self.coordenadas[nome]
+        return [n for n in self.grade.get(self.celula(lat, lon), []) if n != nome]
+
+    def mais_proximos(self, lat: float, lon: float, quantidade: int = 3) -> List[Tuple[str, float]]:
+        """Retorna os pontos mais próximos, expandindo a busca em anéis de células"""
+        if not self.coordenadas:
+            return []
+
+        centro = self.celula(lat, lon)
+        candidatos = []
+        anel = 0
+        # Cobre toda a grade no pior caso
+        max_anel = max(
+            max(abs(c[0] - centro[0]), abs(c[1] - centro[1])) for c in self.grade
+        )
+
+        while anel <= max_anel:
+            for i in range(centro[0] - anel, centro[0] + anel + 1):
+                for j in range(centro[1] - anel, centro[1] + anel + 1):
+                    if max(abs(i - centro[0]), abs(j - centro[1])) != anel:
+                        continue
+                    for nome in self.grade.get((i, j), []):
+                        p_lat, p_lon = self.coordenadas[nome]
+                        candidatos.append((nome, distancia_km(lat, lon, p_lat, p_lon)))
+
+            # Pontos fora do anel atual estão a pelo menos `anel` células de distância
+            if len(candidatos) >= quantidade:
+                limite_km = anel * self.tamanho_celula * 111.0 * math.cos(math.radians(abs(lat) + 1))
+                candidatos.sort(key=lambda c: c[1])
+                if candidatos[quantidade - 1][1] <= limite_km:
+                    break
+            anel += 1
+
+        candidatos.sort(key=lambda c: c[1])
+        return candidatos[:quantidade]
+
+def _normalizar_nome(nome: str) -> str:
+    """Remove acentos, hífens e caixa para comparar nomes de estações"""
+    sem_acento = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii')
+    return " ".join(sem_acento.lower().replace("-", " ").split())
+
+def buscar_estacao(nome: str) -> Tuple[Optional[str], List[str]]:
+    """Encontra uma estação pelo nome, tolerando acentos e erros de digitação.
+
+    Retorna (estação, []) quando o nome é inequívoco, ou (None, candidatas)
+    quando há mais de uma estação possível (lista vazia se nenhuma).
+    """
+    alvo = _normalizar_nome(nome)
+    if not alvo:
+        return None, []
+
+    normalizados = {_normalizar_nome(n): n for n in ESTACOES}
+
+    if alvo in normalizados:
+        return normalizados[alvo], []
+
+    # Nome parcial (ex: "klabin" -> "Chácara Klabin"); se ambíguo, devolve as opções
+    parciais = [n for chave, n in normalizados.items() if alvo in chave]
+    if len(parciais) == 1:
+        return parciais[0], []
+    if parciais:
+        return None, parciais
+
+    # Só erros de digitação pequenos (ex: "paulsta"), para não chutar outra estação
+    parecidos = difflib.get_close_matches(alvo, list(normalizados), n=3, cutoff=0.8)
+    if len(parecidos) == 1:
+        return normalizados[parecidos[0]], []
+
+    return None, [normalizados[p] for p in parecidos]
+
+INDICE_ESTACOES = IndiceEspacial()
+for _nome, _coord in ESTACOES.items():
+    INDICE_ESTACOES.inserir(_nome, _coord['lat'], _coord['lon'])
+
 # ============================================
 # NOVA CLASSE: OPEN-METEO API (100% GRATUITA, SEM TOKEN)
 # ============================================
 class OpenMeteoAPI:
     """Integração com a API gratuita Open-Meteo (não precisa de token)"""
     
-    def __init__(self):
+    # Cache compartilhado entre instâncias, indexado pela célula da grade de
+    # previsão: linhas e estações vizinhas reaproveitam a mesma consulta
+    cache: Dict[str, Any] = {}
+    
+    def __init__(self, prazo: Optional[Prazo] = None):
         self.base_url = "https://api.open-meteo.com/v1/forecast"
-        self.cache = {}
         self.cache_expiration = 1800  # 30 minutos
+        self.prazo = prazo
     
     def get_previsao(self, linha_id):
         """Busca previsão do tempo para a região da linha"""
@@ -324,8 +951,38 @@ class OpenMeteoAPI:
         lat = coord.get('lat', -23.5505)
         lon = coord.get('lon', -46.6333)
         
+        return self.get_previsao_coord(lat, lon)
+    
+    def get_previsao_estacao(self, nome_estacao):
+        """Busca previsão do tempo para a célula da estação"""
+        if nome_estacao not in ESTACOES:
+            return None
+        
+        coord = ESTACOES[nome_estacao]
+        return self.get_previsao_coord(coord['lat'], coord['lon'])
+    
+    def _chave_cache(self, lat, lon):
+        celula = INDICE_ESTACOES.celula(lat, lon)
+        return f"weather_{celula[0]}_{celula[1]}"
+    
+    def previsao_em_cache(self, linha_id):
+        """Previsão da linha já em cache (sem buscar): (horário da busca, dados) ou None"""
+        coord = LINHAS_POR_REGIAO.get(linha_id)
+        if not coord:
+            return None
+        
+        entrada = self.cache.get(self._chave_cache(coord.get('lat', -23.5505), coord.get('lon', -46.6333)))
+        if entrada and time.time() - entrada[0] < self.cache_expiration:
+            return entrada
+        return None
+    
+    def get_previsao_coord(self, lat, lon):
+        """Busca previsão para a célula da grade que contém a coordenada"""
+        celula = INDICE_ESTACOES.celula(lat, lon)
+        lat_celula, lon_celula = INDICE_ESTACOES.centro_celula(celula)
+        
         # Verifica cache
-        cache_key = f"weather_{linha_id}"
+        cache_key = self._chave_cache(lat, lon)
         if cache_key in self.cache:
             cache_time, cache_data = self.cache[cache_key]
             if time.time() - cache_time < self.cache_expiration:
@@ -334,15 +991,18 @@ class OpenMeteoAPI:
         try:
             # Parâmetros da requisição
             params = {
-                "latitude": lat,
-                "longitude": lon,
+                "latitude": lat_celula,
+                "longitude": lon_celula,
                 "current": ["temperature_2m", "relative_humidity_2m", "weather_code", "wind_speed_10m"],
                 "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "precipitation_probability_max", "weather_code"],
                 "timezone": "America/Sao_Paulo",
                 "forecast_days": 5
             }
             
-            response = requests.get(self.base_url, params=params, timeout=10)
+            def buscar(timeout, cancelado):
+                return requests.get(self.base_url, params=params, timeout=timeout)
+            
+            response = executar_com_hedge('open-meteo', buscar, self.prazo, 10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -384,9 +1044,12 @@ class OpenMeteoAPI:
         }
         return weather_codes.get(code, f"Condição {code} 🤷")
     
-    def recomendar_guarda_chuva(self, linha_id):
+    def recomendar_guarda_chuva(self, linha_id, dados=None, perfil=None):
         """Recomenda guarda-chuva baseado na previsão"""
-        dados = self.get_previsao(linha_id)
+        if perfil is None:
+            perfil = LINHAS_POR_REGIAO.get(linha_id, {})
+        if dados is None:
+            dados = self.get_previsao(linha_id)
         
         if not dados:
             return "❓ Não foi possível verificar chuva", "🤷"
@@ -397,7 +1060,7 @@ class OpenMeteoAPI:
         precip_prob = daily.get('precipitation_probability_max', [0])[0]
         
         # Ajuste para linhas elevadas (ex: 15-Prata)
-        if linha_id == "15" or LINHAS_POR_REGIAO.get(linha_id, {}).get('elevado', False):
+        if perfil.get('elevado', False):
             precip_sum *= 1.5
         
         if precip_sum >= 5 or precip_prob > 70:
@@ -407,9 +1070,12 @@ class OpenMeteoAPI:
         else:
             return "☀️ **Pode deixar em casa**! Sem chuva prevista", "😎"
     
-    def recomendar_blusa(self, linha_id):
+    def recomendar_blusa(self, linha_id, dados=None, perfil=None):
         """Recomenda blusa baseado na temperatura"""
-        dados = self.get_previsao(linha_id)
+        if perfil is None:
+            perfil = LINHAS_POR_REGIAO.get(linha_id, {})
+        if dados is None:
+            dados = self.get_previsao(linha_id)
         
         if not dados:
             return "❓ Temperatura não disponível", "🤷"
@@ -427,7 +1093,7 @@ class OpenMeteoAPI:
         min_temp = daily.get('temperature_2m_min', [18])[0]
         
         # Temperatura interna do metrô
-        temp_metro = LINHAS_POR_REGIAO.get(linha_id, {}).get('temp_media_metro', 21)
+        temp_metro = perfil.get('temp_media_metro', 21)
         diferenca = abs(temp_atual - temp_metro)
         
         # Recomendação baseada na temperatura
@@ -457,20 +1123,15 @@ class OpenMeteoAPI:
             msg += f"\n☀️ Umidade baixa ({umidade}%) - hidrate-se!"
         
         # Dica extra para linhas arborizadas
-        if LINHAS_POR_REGIAO.get(linha_id, {}).get('arborizada', False):
+        if perfil.get('arborizada', False):
             msg += f"\n🌳 Estação Trianon tem clima mais ameno pelo parque!"
         
         return msg, emoji
     
-    def gerar_recomendacao_por_linha(self, linha_id):
-        """Gera recomendação completa usando Open-Meteo API"""
-        if linha_id not in LINHAS_POR_REGIAO:
-            return None
-        
-        msg_chuva, emoji_chuva = self.recomendar_guarda_chuva(linha_id)
-        msg_blusa, emoji_blusa = self.recomendar_blusa(linha_id)
-        
-        dados = self.get_previsao(linha_id)
+    def _formatar_recomendacao(self, titulo, local, dados, perfil, rodape="", extra=""):
+        """Monta a mensagem de recomendação (mesmo modelo para linha e estação)"""
+        msg_chuva, emoji_chuva = self.recomendar_guarda_chuva(None, dados or {}, perfil)
+        msg_blusa, emoji_blusa = self.recomendar_blusa(None, dados or {}, perfil)
         
         if dados:
             current = dados.get('current', {})
@@ -484,10 +1145,7 @@ class OpenMeteoAPI:
             
             max_temp = daily.get('temperature_2m_max', ['?'])[0]
             min_temp = daily.get('temperature_2m_min', ['?'])[0]
-            
-            cidade = f"Linha {linha_id} - {LINHAS_POR_REGIAO[linha_id]['bairros'][0]}"
         else:
-            cidade = "São Paulo"
             temp_atual = "?"
             descricao = ""
             umidade = "?"
@@ -495,10 +1153,10 @@ class OpenMeteoAPI:
             max_temp = "?"
             min_temp = "?"
         
-        mensagem = f"""
-🚇 *Recomendação para {LINHAS_POR_REGIAO[linha_id]['nome']}*
+        return f"""
+{titulo}
 
-📍 *Região:* {cidade}
+{local}
 🌡️ *Agora:* {temp_atual}°C - {descricao}
 📊 *Máx/Mín:* {max_temp}° / {min_temp}°
 💧 *Umidade:* {umidade}% | 🌬️ *Vento:* {vento} km/h
@@ -506,14 +1164,78 @@ class OpenMeteoAPI:
 🌤️ *Recomendações:*
 {msg_chuva}
 {msg_blusa}
-
+{extra}
 ---
-💡 *Linha:* {LINHAS_POR_REGIAO[linha_id]['nome']}
-🕐 *Atualizado:* {get_sp_time()}
+{rodape}🕐 *Atualizado:* {get_sp_time()}
 ⚡ Dados via Open-Meteo
 """
-        return mensagem
     
+    def gerar_recomendacao_por_linha(self, linha_id):
+        """Gera recomendação completa usando Open-Meteo API"""
+        if linha_id not in LINHAS_POR_REGIAO:
+            return None
+        
+        linha = LINHAS_POR_REGIAO[linha_id]
+        # Uma única busca: se falhar, não gasta o prazo tentando de novo
+        dados = self.get_previsao(linha_id)
+        cidade = f"Linha {linha_id} - {linha['bairros'][0]}" if dados else "São Paulo"
+        
+        return self._formatar_recomendacao(
+            f"🚇 *Recomendação para {linha['nome']}*",
+            f"📍 *Região:* {cidade}",
+            dados,
+            linha,
+            rodape=f"💡 *Linha:* {linha['nome']}\n",
+        )
+
+    def _perfil_estacao(self, nome_estacao):
+        """Ajustes da estação a partir das linhas que passam por ela.
+
+        Só entram ajustes que valem para o ponto inteiro: temperatura média do
+        metrô das linhas e trecho elevado quando todas as linhas são elevadas.
+        Dicas de uma estação específica (ex.: Trianon) ficam de fora.
+        """
+        linhas = [LINHAS_POR_REGIAO[l] for l in ESTACOES[nome_estacao].get('linhas', [])
+                  if l in LINHAS_POR_REGIAO]
+        if not linhas:
+            return {}
+        return {
+            'temp_media_metro': sum(l.get('temp_media_metro', 21) for l in linhas) / len(linhas),
+            'elevado': all(l.get('elevado', False) for l in linhas),
+        }
+
+    def gerar_recomendacao_por_estacao(self, nome_estacao):
+        """Gera recomendação usando a previsão da célula da estação"""
+        if nome_estacao not in ESTACOES:
+            return None
+
+        estacao = ESTACOES[nome_estacao]
+        linhas = estacao.get('linhas', [])
+        dados = self.get_previsao_estacao(nome_estacao)
+
+        nomes_linhas = ", ".join(LINHAS_POR_REGIAO[l]['nome'] for l in linhas) or "—"
+        mesma_celula = set(INDICE_ESTACOES.na_mesma_celula(nome_estacao))
+        # Estações mais próximas (a própria estação vem primeiro, a 0 km)
+        proximas = [
+            (nome, km) for nome, km in INDICE_ESTACOES.mais_proximos(estacao['lat'], estacao['lon'], 4)
+            if nome != nome_estacao
+        ]
+
+        extra = ""
+        if proximas:
+            extra += "\n📍 *Estações próximas:*\n"
+            for nome, km in proximas:
+                marca = " (mesma previsão)" if nome in mesma_celula else ""
+                extra += f"  • {nome} - {km:.1f} km{marca}\n"
+
+        return self._formatar_recomendacao(
+            f"🚉 *Recomendação para a Estação {nome_estacao}*",
+            f"🚇 *Linhas:* {nomes_linhas}",
+            dados,
+            self._perfil_estacao(nome_estacao),
+            extra=extra,
+        )
+
     def gerar_previsao_5dias(self, linha_id):
         """Gera previsão resumida para 5 dias"""
         if linha_id not in LINHAS_POR_REGIAO:
@@ -562,30 +1284,81 @@ class OpenMeteoAPI:
 # ============================================
 # FUNÇÕES DOS ALERTAS
 # ============================================
-def enviar_alerta_linhas():
-    """Envia alerta das linhas 2, 4 e 15 + clima"""
+def _domingo_de_pascoa(ano: int) -> date:
+    """Data da Páscoa (algoritmo de Meeus/Jones/Butcher)"""
+    a = ano % 19
+    b, c = divmod(ano, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(ano, mes, dia + 1)
+
+def feriados(ano: int) -> Dict[date, str]:
+    """Feriados nacionais, estaduais (SP) e municipais (São Paulo) do ano"""
+    pascoa = _domingo_de_pascoa(ano)
+    lista = {
+        date(ano, 1, 1): "Confraternização Universal",
+        date(ano, 1, 25): "Aniversário de São Paulo",
+        date(ano, 4, 21): "Tiradentes",
+        date(ano, 5, 1): "Dia do Trabalho",
+        date(ano, 7, 9): "Revolução Constitucionalista",
+        date(ano, 9, 7): "Independência",
+        date(ano, 10, 12): "Nossa Senhora Aparecida",
+        date(ano, 11, 2): "Finados",
+        date(ano, 11, 15): "Proclamação da República",
+        date(ano, 11, 20): "Consciência Negra",
+        date(ano, 12, 25): "Natal",
+        pascoa - timedelta(days=48): "Carnaval",
+        pascoa - timedelta(days=47): "Carnaval",
+        pascoa - timedelta(days=2): "Sexta-feira Santa",
+        pascoa + timedelta(days=60): "Corpus Christi"
+    }
+    for extra in FERIADOS_EXTRAS:
+        try:
+            lista[datetime.strptime(extra, "%Y-%m-%d").date()] = "Feriado configurado"
+        except ValueError:
+            print(f"❌ Feriado extra inválido: {extra}")
+    return lista
+
+def motivo_sem_alerta(dia: date) -> Optional[str]:
+    """Motivo para não enviar alerta no dia (final de semana ou feriado)"""
+    if dia.weekday() >= 5:
+        return "Final de semana"
+    feriado = feriados(dia.year).get(dia)
+    if feriado:
+        return f"Feriado ({feriado})"
+    return None
+
+def enviar_alerta_linhas(resultados: Optional[List[Dict[str, Any]]] = None, prazo: Optional[Prazo] = None) -> bool:
+    """Envia alerta das linhas 2, 4 e 15 + clima (False se a mensagem não foi entregue)"""
     if not CHAT_ID:
         print("❌ CHAT_ID não configurado para alertas")
-        return
+        return False
     
-    # Verifica se é dia útil (segunda a sexta)
+    # Verifica se é dia útil (segunda a sexta, fora feriados)
     agora = datetime.now(pytz.timezone('America/Sao_Paulo'))
-    dia_semana = agora.weekday()
+    motivo = motivo_sem_alerta(agora.date())
     
-    if dia_semana >= 5:
-        print(f"📅 Final de semana - Alerta suprimido")
-        return
+    if motivo:
+        print(f"📅 {motivo} - Alerta suprimido")
+        return True
     
     print(f"🚇 Enviando alerta das linhas 2,4,15 - {get_sp_time()}")
     
     # Linhas para alertar
-    linhas_alertar = ["2", "4", "15"]
+    linhas_alertar = LINHAS_ALERTA
     
-    resultados = verificar_todas_linhas()
+    prazo = prazo or Prazo(PRAZO_ALERTA)
+    if not resultados:
+        resultados = verificar_todas_linhas(prazo)
     
     if not resultados:
-        send_telegram_message(CHAT_ID, "❌ *Erro na verificação das linhas!*\nO site pode estar fora do ar.")
-        return
+        return send_telegram_message(CHAT_ID, "❌ *Erro na verificação das linhas!*\nO site pode estar fora do ar.", prazo)
     
     now = get_sp_time()
     mensagem = f"🚇 *Alerta Diário - {now}*\n\n"
@@ -602,9 +1375,12 @@ def enviar_alerta_linhas():
     mensagem += "\n" + "="*30 + "\n\n"
     mensagem += "🌤️ *Clima Personalizado por Linha:*\n\n"
     
-    # Clima para cada linha
-    clima = OpenMeteoAPI()
+    # Clima para cada linha (se o prazo acabar, o alerta sai só com o status)
+    clima = OpenMeteoAPI(prazo)
     for linha_id in linhas_alertar:
+        if prazo.esgotado():
+            mensagem += f"*Linha {linha_id}:* ⏱️ Clima indisponível no momento\n"
+            continue
         rec = clima.gerar_recomendacao_por_linha(linha_id)
         if rec:
             # Extrai só a parte das recomendações
@@ -612,7 +1388,7 @@ def enviar_alerta_linhas():
             linhas_rec = partes[0].split("\n")
             # Pega só as linhas relevantes
             for line in linhas_rec:
-                if "🌧️" in line or "🌦️" in line or "☀️" in line or \
+                if "🌧️" in line or "🌦️" in line or "☀️" in line or "❓" in line or \
                    "🥶" in line or "🧥" in line or "👕" in line or "😎" in line or "🔥" in line:
                     mensagem += f"*Linha {linha_id}:* {line.strip()}\n"
     
@@ -620,8 +1396,12 @@ def enviar_alerta_linhas():
     mensagem += "📊 Para ver todas as linhas, use /todas\n"
     mensagem += "🌤️ Para clima detalhado, use /clima [linha]"
     
-    send_telegram_message(CHAT_ID, mensagem)
-    print("✅ Alerta enviado com sucesso!")
+    enviado = send_telegram_message(CHAT_ID, mensagem, prazo)
+    if enviado:
+        print("✅ Alerta enviado com sucesso!")
+    else:
+        print("❌ Falha ao enviar o alerta")
+    return enviado
 
 def executar_modo_github_actions():
     """Função chamada quando executado pelo GitHub Actions"""
@@ -631,9 +1411,214 @@ def executar_modo_github_actions():
     
     if tipo_alerta == 'linhas_especificas':
         enviar_alerta_linhas()
+    elif tipo_alerta == 'reserva':
+        executar_reserva_alerta()
     else:
         print("ℹ️ Nenhum alerta específico configurado")
 
+# ============================================
+# AGENDADOR DE ALERTAS (SUBSTITUI O CRON DO GITHUB ACTIONS)
+# ============================================
+def _ler_horarios_alerta(horarios: List[str]) -> List[Tuple[int, int]]:
+    """Converte os "HH:MM" da configuração em (hora, minuto) ordenados; inválidos são ignorados"""
+    validos = set()
+    for horario in horarios:
+        try:
+            hora, minuto = (int(x) for x in horario.split(':'))
+            if not (0 <= hora < 24 and 0 <= minuto < 60):
+                raise ValueError(horario)
+            validos.add((hora, minuto))
+        except ValueError:
+            print(f"⚠️ Horário de alerta inválido ignorado: '{horario}' (use HH:MM)")
+    return sorted(validos)
+
+HORARIOS_ALERTA_HM = _ler_horarios_alerta(HORARIOS_ALERTA)
+
+def _proximo_horario_alerta(agora: datetime) -> Optional[datetime]:
+    """Próximo horário de alerta em dia útil, a partir de `agora` (fuso de SP)"""
+    fuso_sp = pytz.timezone('America/Sao_Paulo')
+    
+    for dias in range(15):
+        dia = agora.date() + timedelta(days=dias)
+        if motivo_sem_alerta(dia):
+            continue
+        for hora, minuto in HORARIOS_ALERTA_HM:
+            horario_alerta = fuso_sp.localize(datetime(dia.year, dia.month, dia.day, hora, minuto))
+            if horario_alerta > agora:
+                return horario_alerta
+    
+    return None
+
+def _horario_alerta_perto(agora: datetime, janela: float) -> Optional[datetime]:
+    """Horário de alerta de hoje (em dia útil) a até `janela` segundos de `agora`"""
+    if motivo_sem_alerta(agora.date()):
+        return None
+    
+    fuso_sp = pytz.timezone('America/Sao_Paulo')
+    for hora, minuto in HORARIOS_ALERTA_HM:
+        horario_alerta = fuso_sp.localize(datetime(agora.year, agora.month, agora.day, hora, minuto))
+        if abs((horario_alerta - agora).total_seconds()) <= janela:
+            return horario_alerta
+    
+    return None
+
+def _marcador_envio(horario_alerta: datetime) -> str:
+    return os.path.join(AGENDADOR_DIR, f"alerta_{horario_alerta:%Y%m%d%H%M}.enviado")
+
+def _liberar_envio(horario_alerta: datetime):
+    """Desfaz a marcação de um envio que falhou, para a reserva poder tentar"""
+    try:
+        os.remove(_marcador_envio(horario_alerta))
+    except FileNotFoundError:
+        pass
+
+def _reservar_envio(horario_alerta: datetime) -> bool:
+    """Marca o horário como enviado; só o primeiro worker a marcar envia"""
+    marcador = _marcador_envio(horario_alerta)
+    try:
+        fd = os.open(marcador, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+    except FileExistsError:
+        return False
+    
+    # Limpa marcadores de mais de uma semana
+    limite = time.time() - 7 * 86400
+    for nome in os.listdir(AGENDADOR_DIR):
+        caminho = os.path.join(AGENDADOR_DIR, nome)
+        if nome.startswith("alerta_") and nome.endswith(".enviado") and os.path.getmtime(caminho) < limite:
+            os.remove(caminho)
+    
+    return True
+
+def aquecer_alerta(prazo: Prazo):
+    """Busca status e previsões das linhas do alerta antes do horário de envio"""
+    inicio = time.time()
+    resultados = verificar_todas_linhas(prazo)
+    
+    clima = OpenMeteoAPI(prazo)
+    for linha_id in LINHAS_ALERTA:
+        clima.get_previsao(linha_id)
+    
+    print(f"🔥 Alerta aquecido em {time.time() - inicio:.2f}s ({len(resultados)} linhas)")
+
+def executar_agendador():
+    """Laço do agendador: aquece o cache e envia o alerta no minuto exato"""
+    # Só um worker por máquina fica com o lock; os outros esperam aqui
+    # e assumem se o dono do lock morrer
+    lock = open(os.path.join(AGENDADOR_DIR, "monitor_linhas_agendador.lock"), 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    horarios = ', '.join(f"{hora:02d}:{minuto:02d}" for hora, minuto in HORARIOS_ALERTA_HM) or "nenhum válido"
+    print(f"⏰ Agendador ativo (pid {os.getpid()}) - horários {horarios}")
+    
+    fuso_sp = pytz.timezone('America/Sao_Paulo')
+    
+    while True:
+        try:
+            agora = datetime.now(fuso_sp)
+            horario_alerta = _proximo_horario_alerta(agora)
+            if horario_alerta is None:
+                time.sleep(3600)
+                continue
+            
+            alvo = horario_alerta.timestamp()
+            aquecer_em = alvo - ANTECEDENCIA_AQUECIMENTO
+            
+            # Dorme em blocos curtos para acompanhar ajustes do relógio
+            while time.time() < aquecer_em:
+                time.sleep(min(60, aquecer_em - time.time()))
+            
+            aquecer_alerta(Prazo(max(1, alvo - time.time() - 1)))
+            
+            if time.time() < alvo:
+                time.sleep(alvo - time.time())
+            
+            if not _reservar_envio(horario_alerta):
+                print(f"ℹ️ Alerta de {horario_alerta:%H:%M} já enviado por outro worker")
+                continue
+            
+            if not enviar_alerta_linhas(snapshot_status(ANTECEDENCIA_AQUECIMENTO + 60)):
+                _liberar_envio(horario_alerta)
+                continue
+            desvio = time.time() - alvo
+            print(f"⏱️ Alerta de {horario_alerta:%d/%m %H:%M} entregue {desvio:+.2f}s após o horário")
+        except Exception as e:
+            print(f"❌ Erro no agendador: {str(e)}")
+            time.sleep(60)
+
+def executar_amostragem_historico():
+    """Grava o status de todas as linhas a cada HISTORICO_AMOSTRAGEM segundos, mesmo sem consultas"""
+    # Um worker por máquina amostra; os outros só leem o arquivo
+    lock = open(os.path.join(AGENDADOR_DIR, "monitor_linhas_amostragem.lock"), 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    print(f"📈 Amostragem do histórico ativa (pid {os.getpid()}) - a cada {HISTORICO_AMOSTRAGEM}s")
+    
+    fuso_sp = pytz.timezone('America/Sao_Paulo')
+    compactado_em = None
+    
+    while True:
+        try:
+            # Uma vez por dia (e ao iniciar) descarta o que o /historico não mostra mais
+            hoje = datetime.now(fuso_sp).date()
+            if compactado_em != hoje:
+                HISTORICO.compactar()
+                compactado_em = hoje
+            
+            # Uma consulta recente deste worker já gravou a amostra
+            if not snapshot_status(HISTORICO_AMOSTRAGEM):
+                verificar_todas_linhas(Prazo(PRAZO_COMANDO))
+        except Exception as e:
+            print(f"❌ Erro na amostragem do histórico: {str(e)}")
+        time.sleep(HISTORICO_AMOSTRAGEM)
+
+def executar_reserva_alerta():
+    """Reserva do GitHub Actions: acorda o servidor e garante que o alerta do horário saiu"""
+    fuso_sp = pytz.timezone('America/Sao_Paulo')
+    horario_alerta = _horario_alerta_perto(datetime.now(fuso_sp), RESERVA_JANELA)
+    if horario_alerta is None:
+        print("ℹ️ Nenhum alerta neste horário (fim de semana, feriado ou fora da janela)")
+        return
+    
+    if not SERVIDOR_URL:
+        # Sem como perguntar ao servidor se o agendador já enviou, enviar daqui
+        # duplicaria o alerta
+        print("⚠️ SERVIDOR_URL não configurado - reserva desativada, nada enviado")
+        return
+    
+    # Acorda o servidor (no plano free ele dorme) a tempo de o agendador aquecer o cache
+    for _ in range(6):
+        try:
+            if requests.get(f"{SERVIDOR_URL}/healthz", timeout=30).status_code == 200:
+                print("✅ Servidor acordado")
+                break
+        except Exception as e:
+            print(f"⏳ Servidor ainda não respondeu: {str(e)}")
+        time.sleep(10)
+    
+    # Espera o horário passar: se o agendador já enviou, o servidor só confirma
+    espera = horario_alerta.timestamp() + 60 - time.time()
+    if espera > 0:
+        time.sleep(espera)
+    
+    try:
+        response = requests.post(f"{SERVIDOR_URL}/alerta/{TELEGRAM_TOKEN}", timeout=120)
+        if response.status_code == 200:
+            print(f"✅ Servidor: {response.text}")
+            return
+        print(f"❌ Servidor respondeu {response.status_code}: {response.text[:100]}")
+    except Exception as e:
+        print(f"❌ Servidor indisponível: {str(e)}")
+    
+    print("⚠️ Enviando o alerta direto do GitHub Actions")
+    enviar_alerta_linhas()
+
+def iniciar_agendador():
+    """Inicia o agendador e a amostragem do histórico em threads de fundo"""
+    thread = threading.Thread(target=executar_agendador, name="agendador-alertas", daemon=True)
+    thread.start()
+    
+    amostragem = threading.Thread(target=executar_amostragem_historico, name="amostragem-historico", daemon=True)
+    amostragem.start()
+
 def setup_webhook():
     """Configura o webhook no Telegram"""
     render_url = os.environ.get('RENDER_EXTERNAL_URL')
@@ -651,12 +1636,251 @@ def setup_webhook():
             print(f"❌ Erro: {str(e)}")
 
 # ============================================
-# ROTAS DO FLASK (WEBHOOK)
+# MODO LONG POLLING (SEM URL PÚBLICA)
 # ============================================
-@app.route(f'/webhook/{TELEGRAM_TOKEN}', methods=['POST'])
-def webhook():
-    """Recebe atualizações do Telegram"""
-    update = request.get_json()
+def buscar_updates(offset: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+    """Busca um lote de updates via getUpdates (long polling)"""
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates"
+
+    params = {
+        "timeout": POLLING_TIMEOUT,
+        "limit": POLLING_LOTE_MAXIMO,
+        "allowed_updates": json.dumps(["message", "inline_query"])
+    }
+    if offset is not None:
+        params["offset"] = offset
+
+    try:
+        response = requests.get(url, params=params, timeout=POLLING_TIMEOUT + 10)
+        if response.status_code == 200:
+            return response.json().get('result', [])
+        print(f"❌ Erro getUpdates: {response.status_code} {response.text[:100]}")
+    except Exception as e:
+        print(f"❌ Erro getUpdates: {str(e)}")
+
+    return None
+
+def _processar_updates_do_chat(updates: List[Dict[str, Any]]):
+    """Processa em ordem os updates de um mesmo chat"""
+    for update in updates:
+        try:
+            processar_update(update)
+        except Exception as e:
+            print(f"❌ Erro ao processar update {update.get('update_id')}: {str(e)}")
+
+def processar_lote(updates: List[Dict[str, Any]], executor: ThreadPoolExecutor):
+    """Processa um lote em paralelo entre chats, mantendo a ordem dentro de cada chat"""
+    por_chat: Dict[str, List[Dict[str, Any]]] = {}
+    for update in sorted(updates, key=lambda u: u['update_id']):
+        if 'inline_query' in update:
+            chat_id = f"inline_{update['inline_query'].get('from', {}).get('id', '')}"
+        else:
+            chat_id = str(update.get('message', {}).get('chat', {}).get('id', ''))
+        por_chat.setdefault(chat_id, []).append(update)
+
+    futuros = [executor.submit(_processar_updates_do_chat, lista) for lista in por_chat.values()]
+    for futuro in futuros:
+        futuro.result()
+
+def executar_modo_polling():
+    """Recebe comandos via getUpdates em vez do webhook"""
+    if not TELEGRAM_TOKEN:
+        print("❌ Erro: TELEGRAM_TOKEN não configurado")
+        return
+
+    print(f"🚇 Bot iniciando em modo polling - {get_sp_time()}")
+
+    # getUpdates não funciona enquanto houver webhook configurado
+    try:
+        requests.post(f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/deleteWebhook", timeout=15)
+    except Exception as e:
+        print(f"❌ Erro ao remover webhook: {str(e)}")
+
+    offset = None
+
+    with ThreadPoolExecutor(max_workers=POLLING_WORKERS) as executor:
+        try:
+            while True:
+                updates = buscar_updates(offset)
+
+                if updates is None:
+                    time.sleep(5)
+                    continue
+                if not updates:
+                    continue
+
+                inicio = time.time()
+                processar_lote(updates, executor)
+                duracao = time.time() - inicio
+
+                # Só confirma o lote (avança o offset) depois de processado
+                offset = max(u['update_id'] for u in updates) + 1
+
+                datas = [u['message']['date'] for u in updates if 'date' in u.get('message', {})]
+                latencia = time.time() - min(datas) if datas else 0
+                print(f"📦 Lote de {len(updates)} updates em {duracao:.2f}s "
+                      f"({len(updates) / max(duracao, 0.001):.1f} updates/s, latência máx {latencia:.1f}s)")
+        except KeyboardInterrupt:
+            print("🛑 Polling interrompido")
+        finally:
+            # Confirma o último lote processado para não reprocessá-lo no próximo início
+            if offset is not None:
+                try:
+                    requests.get(f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates",
+                                 params={"offset": offset, "timeout": 0}, timeout=15)
+                except Exception as e:
+                    print(f"❌ Erro ao confirmar offset: {str(e)}")
+
+# ============================================
+# MODO INLINE (@MonitorLinhasSP_bot 4)
+# ============================================
+# Resultados prontos por linha, refeitos só quando os snapshots mudam
+_RESULTADOS_INLINE: Dict[str, Any] = {'versao': None, 'por_linha': {}}
+_LOCK_RESULTADOS_INLINE = threading.Lock()
+_LOCK_ATUALIZACAO_INLINE = threading.Lock()
+_ULTIMA_FALHA_INLINE = {'ts': 0.0}
+
+def _em_espera_apos_falha() -> bool:
+    """Depois de uma consulta que falhou, espera INLINE_ESPERA_FALHA antes de tentar de novo"""
+    return time.time() - _ULTIMA_FALHA_INLINE['ts'] < INLINE_ESPERA_FALHA
+
+def _atualizar_snapshots(prazo: Prazo, linhas_clima: List[str]):
+    """Consulta status e previsões (chamar com _LOCK_ATUALIZACAO_INLINE obtido)"""
+    if not verificar_todas_linhas(prazo):
+        _ULTIMA_FALHA_INLINE['ts'] = time.time()
+        return
+    
+    clima = OpenMeteoAPI(prazo)
+    for linha_id in linhas_clima:
+        if prazo.esgotado():
+            break
+        clima.get_previsao(linha_id)
+
+def _atualizar_snapshots_em_segundo_plano():
+    """Atualiza status e previsões sem segurar a resposta inline (uma atualização por vez)"""
+    if _em_espera_apos_falha() or not _LOCK_ATUALIZACAO_INLINE.acquire(blocking=False):
+        return
+    
+    # Linhas do alerta primeiro: são as mais pedidas logo depois de iniciar
+    linhas_clima = LINHAS_ALERTA + [l for l in LINHAS_POR_REGIAO if l not in LINHAS_ALERTA]
+    
+    def tarefa():
+        try:
+            _atualizar_snapshots(Prazo(PRAZO_COMANDO), linhas_clima)
+        finally:
+            _LOCK_ATUALIZACAO_INLINE.release()
+    
+    threading.Thread(target=tarefa, name="atualizacao-inline", daemon=True).start()
+
+def _montar_resultados_inline() -> Dict[str, List[Dict[str, Any]]]:
+    """Resultados inline por linha a partir do snapshot de status e do cache de clima"""
+    clima = OpenMeteoAPI()
+    previsoes = {linha_id: clima.previsao_em_cache(linha_id) for linha_id in TODAS_LINHAS}
+    versao = (_SNAPSHOT_STATUS['ts'],) + tuple(p[0] if p else None for p in previsoes.values())
+    
+    with _LOCK_RESULTADOS_INLINE:
+        if _RESULTADOS_INLINE['versao'] == versao:
+            return _RESULTADOS_INLINE['por_linha']
+        
+        atualizado = datetime.fromtimestamp(_SNAPSHOT_STATUS['ts'], pytz.timezone('America/Sao_Paulo'))
+        por_linha: Dict[str, List[Dict[str, Any]]] = {}
+        
+        for resultado in _SNAPSHOT_STATUS['resultados']:
+            msg = f"🚇 *{resultado['nome']}*\n\n"
+            msg += f"📊 Status: {resultado['status']}\n"
+            if resultado['detalhes']:
+                msg += f"ℹ️ {resultado['detalhes']}\n"
+            msg += f"🕐 *Atualizado:* {atualizado:%d/%m/%Y %H:%M}"
+            
+            por_linha.setdefault(resultado['id'], []).append({
+                'type': 'article',
+                'id': f"status_{resultado['id']}",
+                'title': f"{resultado['nome']}: {resultado['status']}",
+                'description': f"{resultado['operadora']} - atualizado às {atualizado:%H:%M}",
+                'input_message_content': {
+                    'message_text': msg,
+                    'parse_mode': 'Markdown',
+                    'disable_web_page_preview': True
+                }
+            })
+        
+        for linha_id, previsao in previsoes.items():
+            if not previsao:
+                continue
+            # Previsão já em cache: gerar a recomendação não faz nova consulta
+            msg_chuva, _ = clima.recomendar_guarda_chuva(linha_id, previsao[1])
+            por_linha.setdefault(linha_id, []).append({
+                'type': 'article',
+                'id': f"clima_{linha_id}",
+                'title': f"🌤️ Clima - {TODAS_LINHAS[linha_id]['nome']}",
+                'description': msg_chuva.replace("**", ""),
+                'input_message_content': {
+                    'message_text': clima.gerar_recomendacao_por_linha(linha_id),
+                    'parse_mode': 'Markdown',
+                    'disable_web_page_preview': True
+                }
+            })
+        
+        _RESULTADOS_INLINE['versao'] = versao
+        _RESULTADOS_INLINE['por_linha'] = por_linha
+        return por_linha
+
+def _filtrar_resultados_inline(por_linha: Dict[str, List[Dict[str, Any]]], consulta: str) -> List[Dict[str, Any]]:
+    """Escolhe as linhas pela consulta: número ("4"), nome ("amarela") ou vazio (todas)"""
+    termo = _normalizar_nome(consulta)
+    
+    if not termo:
+        linhas = list(TODAS_LINHAS)
+    elif termo in TODAS_LINHAS:
+        linhas = [termo]
+    else:
+        linhas = [lid for lid, info in TODAS_LINHAS.items() if termo in _normalizar_nome(info['nome'])]
+    
+    resultados = []
+    for linha_id in linhas:
+        resultados.extend(por_linha.get(linha_id, []))
+    return resultados[:50]  # limite do Telegram por resposta
+
+def responder_inline_query(inline_query: Dict[str, Any], prazo: Prazo):
+    """Responde uma inline query com resultados pré-calculados e cache_time no Telegram"""
+    # Snapshot vazio (recém-iniciado) ou velho: a busca vai para o fundo e a
+    # resposta sai agora com o que houver
+    if not _SNAPSHOT_STATUS['resultados'] or time.time() - _SNAPSHOT_STATUS['ts'] > INLINE_IDADE_MAXIMA:
+        _atualizar_snapshots_em_segundo_plano()
+    
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/answerInlineQuery"
+    data = {
+        "inline_query_id": inline_query['id'],
+        "is_personal": False
+    }
+    
+    if _SNAPSHOT_STATUS['resultados']:
+        resultados = _filtrar_resultados_inline(_montar_resultados_inline(), inline_query.get('query', ''))
+        data["cache_time"] = INLINE_CACHE_TIME
+    else:
+        # Ainda carregando: lista vazia sem cache, para a próxima tecla já trazer os resultados
+        resultados = []
+        data["cache_time"] = 0
+        data["button"] = json.dumps({"text": "⏳ Carregando status... abrir o bot", "start_parameter": "inline"})
+    data["results"] = json.dumps(resultados)
+    
+    try:
+        response = requests.post(url, data=data, timeout=prazo.timeout(15, minimo=PRAZO_MINIMO_ENVIO))
+        if response.status_code != 200:
+            print(f"❌ Erro answerInlineQuery: {response.text[:100]}")
+    except Exception as e:
+        print(f"❌ Erro ao responder inline query: {str(e)}")
+
+# ============================================
+# PROCESSAMENTO DOS COMANDOS
+# ============================================
+def processar_update(update: Dict[str, Any]):
+    """Processa um update do Telegram (webhook ou long polling)"""
+    prazo = Prazo(PRAZO_COMANDO)
+    
+    if 'inline_query' in update:
+        responder_inline_query(update['inline_query'], prazo)
+        return
     
     if 'message' in update and 'text' in update['message']:
         chat_id = str(update['message']['chat']['id'])
@@ -664,7 +1888,7 @@ def webhook():
         
         print(f"📩 Mensagem: {text}")
         
-        if text == '/start':
+        if text.split(' ')[0] == '/start':
             mensagem = """
 🚇 *Bem-vindo ao Monitor Linhas SP + Clima Inteligente!*
 
@@ -679,19 +1903,27 @@ def webhook():
   Ex: `/clima 2` (linha 2-Verde)
   Ex: `/clima 4` (linha 4-Amarela)
   Ex: `/clima 15` (linha 15-Prata)
+/clima estacao [nome] - Recomendação para uma estação
+  Ex: `/clima estacao Jundiaí`
 
 /previsao [linha] - Previsão de 5 dias para sua região
 
+📈 *Histórico:*
+/historico [linha] - Disponibilidade do dia, semana e mês
+
+⚡ *Modo inline:* em qualquer conversa digite
+`@MonitorLinhasSP_bot 4` para compartilhar o status da linha
+
 🤖 *Notificações automáticas:*
 Segunda a sexta 7h e 17h: Status linhas 2,4,15 + clima personalizado
 
 🔢 *Linhas disponíveis:* 1,2,3,4,5,7,8,9,10,11,12,13,15
 """
-            send_telegram_message(chat_id, mensagem)
+            send_telegram_message(chat_id, mensagem, prazo)
             
         elif text == '/todas':
-            send_telegram_message(chat_id, "🔍 Consultando...")
-            resultados = verificar_todas_linhas()
+            send_telegram_message(chat_id, "🔍 Consultando...", prazo)
+            resultados = verificar_todas_linhas(prazo)
             
             if resultados:
                 now = get_sp_time()
@@ -711,44 +1943,78 @@ Segunda a sexta 7h e 17h: Status linhas 2,4,15 + clima personalizado
                         msg += f"  • *Linha {linha['id']}*: {linha['status']}\n"
                     msg += "\n"
                 
-                send_telegram_message(chat_id, msg)
+                send_telegram_message(chat_id, msg, prazo)
             else:
-                send_telegram_message(chat_id, "❌ Erro na consulta")
+                send_telegram_message(chat_id, "❌ Erro na consulta", prazo)
                 
         elif text.startswith('/linha'):
             partes = text.split(' ', 1)
             if len(partes) > 1:
                 linha_id = partes[1].strip()
-                resultado = verificar_linha_especifica(linha_id)
+                resultado = verificar_linha_especifica(linha_id, prazo)
                 
                 if resultado:
                     msg = f"🚇 *{resultado['nome']}*\n\n"
                     msg += f"📊 Status: {resultado['status']}\n"
                     if resultado['detalhes']:
                         msg += f"ℹ️ {resultado['detalhes']}\n"
-                    send_telegram_message(chat_id, msg)
+                    send_telegram_message(chat_id, msg, prazo)
                 else:
                     msg = "❌ Linha inválida. Use: 1,2,3,4,5,7,8,9,10,11,12,13,15"
-                    send_telegram_message(chat_id, msg)
+                    send_telegram_message(chat_id, msg, prazo)
         
         # ===== COMANDOS DE CLIMA =====
         elif text.startswith('/clima'):
             partes = text.split(' ', 1)
-            if len(partes) > 1:
-                linha_id = partes[1].strip()
+            argumento = partes[1].strip() if len(partes) > 1 else ""
+            
+            if _normalizar_nome(argumento).split(' ', 1)[0] == 'estacao':
+                termo = argumento.split(' ', 1)[1].strip() if ' ' in argumento else ""
+                nome_estacao, candidatas = buscar_estacao(termo)
+                
+                if not termo:
+                    msg = """
+🚉 *Recomendação por Estação*
+
+Use: `/clima estacao [nome da estação]`
+
+Exemplos:
+/clima estacao Paulista
+/clima estacao Jundiai
+/clima estacao Santo Amaro
+"""
+                    send_telegram_message(chat_id, msg, prazo)
+                elif nome_estacao:
+                    send_telegram_message(chat_id, f"🔍 Consultando clima na estação {nome_estacao}...", prazo)
+                    
+                    clima = OpenMeteoAPI(prazo)
+                    mensagem = clima.gerar_recomendacao_por_estacao(nome_estacao)
+                    if mensagem:
+                        send_telegram_message(chat_id, mensagem, prazo)
+                    else:
+                        send_telegram_message(chat_id, "❌ Erro ao buscar dados do clima", prazo)
+                elif candidatas:
+                    msg = f"🤔 Mais de uma estação para '{termo}'. Você quis dizer:\n"
+                    msg += "\n".join(f"/clima estacao {c}" for c in candidatas)
+                    send_telegram_message(chat_id, msg, prazo)
+                else:
+                    msg = f"❌ Estação '{termo}' não encontrada!\nEx: `/clima estacao Paulista`"
+                    send_telegram_message(chat_id, msg, prazo)
+            elif argumento:
+                linha_id = argumento
                 
                 if linha_id in LINHAS_POR_REGIAO:
-                    send_telegram_message(chat_id, "🔍 Consultando clima em tempo real...")
+                    send_telegram_message(chat_id, "🔍 Consultando clima em tempo real...", prazo)
                     
-                    clima = OpenMeteoAPI()
+                    clima = OpenMeteoAPI(prazo)
                     mensagem = clima.gerar_recomendacao_por_linha(linha_id)
                     if mensagem:
-                        send_telegram_message(chat_id, mensagem)
+                        send_telegram_message(chat_id, mensagem, prazo)
                     else:
-                        send_telegram_message(chat_id, "❌ Erro ao buscar dados do clima")
+                        send_telegram_message(chat_id, "❌ Erro ao buscar dados do clima", prazo)
                 else:
                     msg = f"❌ Linha {linha_id} não encontrada!\nDisponíveis: 1,2,3,4,5,7,8,9,10,11,12,13,15"
-                    send_telegram_message(chat_id, msg)
+                    send_telegram_message(chat_id, msg, prazo)
             else:
                 msg = """
 🌤️ *Recomendação por Linha*
@@ -760,29 +2026,78 @@ Exemplos:
 /clima 4 - Linha 4-Amarela
 /clima 15 - Linha 15-Prata
 
+🚉 *Por estação:* `/clima estacao [nome]`
+/clima estacao Paulista
+/clima estacao Jundiai
+
 🔢 *Linhas disponíveis:* 1,2,3,4,5,7,8,9,10,11,12,13,15
 """
-                send_telegram_message(chat_id, msg)
+                send_telegram_message(chat_id, msg, prazo)
+        
+        elif text.startswith('/historico'):
+            partes = text.split(' ', 1)
+            linha_id = partes[1].strip() if len(partes) > 1 else ""
+            
+            if linha_id in TODAS_LINHAS:
+                send_telegram_message(chat_id, gerar_mensagem_historico(linha_id), prazo)
+            else:
+                send_telegram_message(chat_id, "❌ Linha inválida. Use: /historico [linha]", prazo)
         
         elif text.startswith('/previsao'):
             partes = text.split(' ', 1)
             linha_id = partes[1].strip() if len(partes) > 1 else "2"
             
             if linha_id in LINHAS_POR_REGIAO:
-                send_telegram_message(chat_id, "🔍 Buscando previsão...")
+                send_telegram_message(chat_id, "🔍 Buscando previsão...", prazo)
                 
-                clima = OpenMeteoAPI()
+                clima = OpenMeteoAPI(prazo)
                 msg = clima.gerar_previsao_5dias(linha_id)
                 
                 if msg:
-                    send_telegram_message(chat_id, msg)
+                    send_telegram_message(chat_id, msg, prazo)
                 else:
-                    send_telegram_message(chat_id, "❌ Erro ao buscar previsão")
+                    send_telegram_message(chat_id, "❌ Erro ao buscar previsão", prazo)
             else:
-                send_telegram_message(chat_id, "❌ Linha inválida")
-    
+                send_telegram_message(chat_id, "❌ Linha inválida", prazo)
+
+# ============================================
+# ROTAS DO FLASK (WEBHOOK)
+# ============================================
+@app.route(f'/webhook/{TELEGRAM_TOKEN}', methods=['POST'])
+def webhook():
+    """Recebe atualizações do Telegram"""
+    update = request.get_json()
+    inicio = time.time()
+    processar_update(update)
+    duracao = time.time() - inicio
+
+    # Mesma métrica do modo polling: latência desde o envio da mensagem
+    data = (update or {}).get('message', {}).get('date')
+    latencia = time.time() - data if data else 0
+    print(f"📨 Update processado em {duracao:.2f}s (latência {latencia:.1f}s)")
+
     return 'OK', 200
 
+@app.route(f'/alerta/{TELEGRAM_TOKEN}', methods=['POST'])
+def disparar_alerta():
+    """Envio de reserva do alerta, chamado pelo GitHub Actions após o horário"""
+    agora = datetime.now(pytz.timezone('America/Sao_Paulo'))
+    horario_alerta = _horario_alerta_perto(agora, RESERVA_JANELA)
+    
+    if horario_alerta is None or horario_alerta > agora:
+        return 'Nenhum alerta pendente agora', 200
+    if not _reservar_envio(horario_alerta):
+        return f'Alerta de {horario_alerta:%H:%M} já enviado', 200
+    
+    # Mesmo prazo dos comandos: cabe no timeout do worker do gunicorn (30s),
+    # e o aquecimento do agendador, se houve, é reaproveitado
+    prazo = Prazo(PRAZO_COMANDO)
+    if enviar_alerta_linhas(snapshot_status(ANTECEDENCIA_AQUECIMENTO + 60), prazo):
+        return f'Alerta de {horario_alerta:%H:%M} enviado pela reserva', 200
+    
+    _liberar_envio(horario_alerta)
+    return 'Falha ao enviar o alerta', 500
+
 @app.route('/healthz')
 def health():
     return 'OK', 200
@@ -794,9 +2109,15 @@ def index():
 # ============================================
 # PONTO DE ENTRADA PRINCIPAL
 # ============================================
+# Sob o gunicorn o bloco __main__ não roda, então o agendador sobe na importação
+if AGENDADOR_ATIVO and os.environ.get('GITHUB_ACTIONS') != 'true':
+    iniciar_agendador()
+
 if __name__ == "__main__":
     if os.environ.get('GITHUB_ACTIONS') == 'true':
         executar_modo_github_actions()
+    elif MODO_EXECUCAO == 'polling':
+        executar_modo_polling()
     else:
         print(f"🚇 Bot iniciando em modo servidor - {get_sp_time()}")
         setup_webhook()